@@ -7,8 +7,10 @@ __version__ = '0.3.0-dev.2'
 __author__ = 'Lucas Carvalho Flores'
 
 import enum
+import functools
 import json
 import os
+import weakref
 from collections import OrderedDict
 
 CWD = os.path.abspath(os.path.dirname(__file__))
@@ -28,6 +30,18 @@ class CNABError(Exception):
         self.message = message
         super().__init__(self.message)
 
+    def __reduce__(self):
+        # As subclasses têm construtores com outros parâmetros, então a exceção é recriada a partir da mensagem pronta.
+        # Necessário para que erros atravessem processos, como em ArquivoCNAB240.make_parallel().
+        return _restore_cnab_error, (self.__class__, self.message)
+
+
+def _restore_cnab_error(error_class, message):
+    """Recria uma exceção CNABError serializada, sem passar pelo construtor da subclasse."""
+    error = error_class.__new__(error_class)
+    CNABError.__init__(error, message)
+    return error
+
 
 class CNABInvalidValueError(CNABError):
     """Exceção lançada quando um valor inválido para certo campo é alcançado."""
@@ -54,11 +68,217 @@ class CNABInvalidTemplateError(CNABError):
         super().__init__(msg.rstrip(',') + ' .')
 
 
+_MISSING = object()
+
+
+class CNABField(dict):
+    """Campo de uma linha CNAB ('val', 'index', 'size', ...). Alterações marcam a linha dona como modificada.
+
+    Guarda apenas uma weakref para a linha, sem ciclo de referências: um registro descartado é liberado na hora.
+    """
+
+    __slots__ = ('line_ref',)
+
+    def __init__(self, *args, **kwargs):
+        # dict.__init__ não passa por __setitem__, então a cópia do template não dispara invalidações.
+        super().__init__(*args, **kwargs)
+        self.line_ref = None
+
+    def _changed(self, layout=True):
+        line = self.line_ref() if self.line_ref is not None else None
+        if line is not None:
+            line.invalidate(layout)
+
+    def __setitem__(self, key, value):
+        old = self.get(key, _MISSING)
+        super().__setitem__(key, value)
+        if old != value or type(old) is not type(value):
+            self._changed(key != 'val')
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._changed()
+
+    def pop(self, key, *default):
+        value = super().pop(key, *default)
+        self._changed()
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        self._changed()
+        return item
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def clear(self):
+        super().clear()
+        self._changed()
+
+    def __reduce__(self):
+        # A referência à linha é refeita por CNABLine ao ser recriada.
+        return self.__class__, (dict(self),)
+
+
+class CNABLine(OrderedDict):
+    """Dict de campos de uma linha CNAB (header, trailer ou registro), com cache da string gerada por
+    bake_cnab_string(). Qualquer alteração na linha ou num campo descarta o cache, e só essa linha é gerada de novo no
+    próximo make().
+
+    template_path é o caminho do template de que a linha foi carregada por load_template(), enquanto só os 'val' dos
+    campos forem alterados. Qualquer outra alteração o torna None, pois a linha deixa de seguir o layout do template.
+    """
+
+    def __init__(self, fields=()):
+        super().__init__()
+        self.baked = None  # String gerada na última chamada a bake_cnab_string(), ou None.
+        self.baked_missing = False  # Se a string em cache tem campos ausentes preenchidos com '?'.
+        self.baked_generation = 0  # Valor de _cache_generation quando a string foi gerada.
+        self.ref = weakref.ref(self)  # Compartilhada por todos os campos da linha.
+        self.template_path = None
+        for key, field in dict(fields).items():
+            self[key] = field
+
+    def __setitem__(self, key, field):
+        if isinstance(field, dict) and not isinstance(field, CNABField):
+            field = CNABField(field)
+        if isinstance(field, CNABField):
+            field.line_ref = self.ref
+        super().__setitem__(key, field)
+        self.invalidate(layout=True)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.invalidate(layout=True)
+
+    def pop(self, key, *default):
+        value = super().pop(key, *default)
+        self.invalidate(layout=True)
+        return value
+
+    def popitem(self, last=True):
+        item = super().popitem(last)
+        self.invalidate(layout=True)
+        return item
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, field in dict(*args, **kwargs).items():
+            self[key] = field
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def clear(self):
+        super().clear()
+        self.invalidate(layout=True)
+
+    def move_to_end(self, key, last=True):
+        # A ordem dos campos é a ordem na linha gerada.
+        super().move_to_end(key, last)
+        self.invalidate(layout=True)
+
+    def __reduce__(self):
+        # O cache não é serializado: a cópia gera sua string de novo no processo que a usar.
+        return self.__class__, (list(self.items()),)
+
+    def invalidate(self, layout=False):
+        """Descarta a string em cache. layout == True indica que a alteração não foi só no 'val' de um campo."""
+        if layout:
+            self.template_path = None
+        if self.baked is not None:
+            self.baked = None
+            if _line_cache_limit is not None:
+                _line_cache.pop(id(self), None)
+
+
+# Geração do cache: strings geradas antes da última chamada a set_cache_limit() são ignoradas.
+_cache_generation = 0
+
+# Com limite definido, linhas com string em cache, da menos para a mais recentemente usada. Guarda weakrefs, para não
+# manter vivos blocos descartados. Sem limite, o cache fica apenas nas próprias linhas e esta estrutura não é usada.
+_line_cache = OrderedDict()
+_line_cache_limit = None
+
+
+def set_cache_limit(max_lines=None):
+    """Limita quantas linhas mantêm sua string gerada em cache. Cada linha ocupa cerca de 300 bytes.
+
+    Ao passar do limite, o cache das linhas usadas há mais tempo é descartado. None (padrão) não limita e 0 desliga o
+    cache. Strings geradas antes da chamada deixam de ser reaproveitadas.
+    """
+
+    global _line_cache_limit, _cache_generation
+    _line_cache_limit = max_lines
+    _cache_generation += 1
+    _line_cache.clear()
+
+
+def _cache_line(line: CNABLine, data_str: str, missing: bool):
+    if _line_cache_limit == 0:
+        return
+
+    line.baked = data_str
+    line.baked_missing = missing
+    line.baked_generation = _cache_generation
+
+    if _line_cache_limit is not None:
+        key = id(line)
+        _line_cache[key] = weakref.ref(line, lambda _, key=key: _line_cache.pop(key, None))
+        while len(_line_cache) > _line_cache_limit:
+            _, ref = _line_cache.popitem(last=False)
+            evicted = ref()
+            if evicted is not None:
+                evicted.baked = None
+
+
+@functools.lru_cache(maxsize=None)
+def read_template(path) -> OrderedDict:
+    """Lê e interpreta o JSON de um template uma única vez por processo. O resultado é compartilhado e não deve ser
+    alterado: use load_template() para obter uma cópia editável."""
+    with open(path, 'r') as file:
+        return json.load(file, object_pairs_hook=OrderedDict)
+
+
+def load_template(path) -> CNABLine:
+    """Retorna uma cópia nova do template de uma linha CNAB como CNABLine, com rastreio de alterações nos campos."""
+    line = CNABLine(read_template(path))
+    line.template_path = path
+    return line
+
+
 def bake_cnab_string(data, strict=False):
-    """Navega template de bloco de dados CNAB e gera a string."""
+    """Navega template de bloco de dados CNAB e gera a string.
+
+    Se data for um CNABLine sem alterações desde a última chamada, retorna a string em cache. Uma string gerada com
+    campos ausentes só é reaproveitada quando strict == False, para que o erro continue sendo lançado.
+    """
+
+    if isinstance(data, CNABLine) and data.baked is not None and data.baked_generation == _cache_generation \
+            and not (strict and data.baked_missing):
+        if _line_cache_limit is not None:
+            _line_cache.move_to_end(id(data))
+        return data.baked
 
     # String a receber conteúdo final.
     data_str = ''
+    missing = False
 
     # Concatena conteúdo iterando por seus elementos
     for key in data:
@@ -73,6 +293,7 @@ def bake_cnab_string(data, strict=False):
                 raise CNABInvalidValueError(key, val)
             else:
                 val = '?' * size
+                missing = True
         # Valores válidos são usados como strings.
         else:
             val = str(val)
@@ -89,7 +310,12 @@ def bake_cnab_string(data, strict=False):
 
         data_str += val
 
-    return data_str + '\n'
+    data_str += '\n'
+
+    if isinstance(data, CNABLine):
+        _cache_line(data, data_str, missing)
+
+    return data_str
 
 
 def parse_cnab_string(cnab_str, cnab_layout_code, file_template):
@@ -113,6 +339,58 @@ def parse_cnab_string(cnab_str, cnab_layout_code, file_template):
     return cnab_file
 
 
+@functools.lru_cache(maxsize=None)
+def compile_layout(template_path):
+    """Lê um template de linha e retorna dict campo -> (início, fim, tipo), com as posições prontas para fatiar linhas
+    CNAB sem instanciar blocos. O resultado fica em cache e não deve ser alterado."""
+
+    return OrderedDict((key, (field['index'], field['index'] + field['size'], field['type']))
+                       for key, field in read_template(template_path).items())
+
+
+def bake_values(values, layout, strict=False):
+    """Gera a string de uma linha a partir apenas dos valores dos campos, na ordem do template, e do layout retornado
+    por compile_layout() para ele. O resultado é idêntico ao de bake_cnab_string() para a linha completa, e permite
+    enviar a outros processos só os valores em vez dos dicts de campos."""
+
+    data_str = ''
+
+    for (key, (start, end, val_type)), val in zip(layout.items(), values):
+        size = end - start
+
+        if val is None:
+            if strict:
+                raise CNABInvalidValueError(key, val)
+            val = '?' * size
+        else:
+            val = str(val)
+
+        if len(val) < size:
+            if val_type == 'num':
+                val = '0' * (size - len(val)) + val
+            else:
+                val += ' ' * (size - len(val))
+        elif len(val) > size:
+            val = val[0:size]
+
+        data_str += val
+
+    return data_str + '\n'
+
+
+def line_payload(line, strict=False):
+    """Representação compacta de uma linha para bake_values() noutro processo: a string em cache, se houver, ou
+    (template_path, valores). Linhas que não seguem mais o layout do template são geradas aqui mesmo."""
+
+    if isinstance(line, CNABLine):
+        if line.baked is not None and line.baked_generation == _cache_generation \
+                and not (strict and line.baked_missing):
+            return line.baked
+        if line.template_path is not None:
+            return line.template_path, tuple([field['val'] for field in line.values()])
+    return bake_cnab_string(line, strict=strict)
+
+
 def eval_rule(record: str, rule: dict) -> bool:
     """Verifica se string recebida em record obedece à regra descrita.
 
@@ -217,19 +495,16 @@ class BlocoCNAB:
         # Se não for do tipo [header ... trailer], não se edita o nome do arquivo de template
         # a ser carregado pois só há um.
         if not enclosed:
-            with open(template.value['path'], 'r') as file:
-                self.content = json.load(file, object_pairs_hook=OrderedDict)
+            self.content = load_template(template.value['path'])
 
         # Blocos do tipo [header ... trailer] ajustam o nome do arquivo de template
         # pra carregar as duas partes, header e trailer.
         else:
             # Carrega template do header do bloco.
-            with open(template.value['path'].format('header'), 'r') as file:
-                self.header = json.load(file, object_pairs_hook=OrderedDict)
+            self.header = load_template(template.value['path'].format('header'))
 
             # Carrega template do trailer do bloco.
-            with open(template.value['path'].format('trailer'), 'r') as file:
-                self.trailer = json.load(file, object_pairs_hook=OrderedDict)
+            self.trailer = load_template(template.value['path'].format('trailer'))
 
             # Prepara lista para receber os filhos.
             self.content = []
@@ -287,21 +562,19 @@ class BlocoCNAB:
             data_str = ''
 
             # Concatena conteúdo do header do arquivo de remessa.
-            data_str += bake_cnab_string(self.header, strict=strict)
+            data_str += bake_cnab_string(self.header, strict=strict).replace('\n', '\r\n')
 
-            # Passa por todos os filhos, e concatena.
+            # Passa por todos os filhos, e concatena. Os filhos já retornam suas linhas terminadas em '\r\n'.
             for child in self.content:
                 data_str += child.make(strict=strict)
 
             # Concatena conteúdo do trailer do arquivo de remessa.
-            data_str += bake_cnab_string(self.trailer, strict=strict)
+            data_str += bake_cnab_string(self.trailer, strict=strict).replace('\n', '\r\n')
 
         # Senão, é do tipo registro único. Gera a string e pronto.
         else:
-            data_str = bake_cnab_string(self.content, strict=strict)
-
-        # Windows ANSI shitness
-        data_str = data_str.replace('\n', '\r\n')
+            # Windows ANSI shitness
+            data_str = bake_cnab_string(self.content, strict=strict).replace('\n', '\r\n')
 
         # String final.
         return data_str
@@ -0,0 +1,233 @@
+"""Montagem de arquivos de remessa CNAB 240 com memória limitada.
+
+Um ArquivoCNAB240 mantém todos os seus lotes e registros em memória até o make(). O ArquivoCNAB240Builder gera as
+linhas assim que cada lote, ou cada registro de um lote aberto, é adicionado, e despeja o texto num arquivo temporário
+sempre que o buffer passa do orçamento de memória. Só ficam residentes os totais usados nos trailers e os contadores de
+codigo_lote e numero_registro.
+
+Exemplo de uso:
+
+    builder = ArquivoCNAB240Builder(FileTemplate240.FileItau, memory_budget=8 * 1024 * 1024)
+    builder.header['...'] = ...  # Altere o header no que for necessário.
+
+    lote_ted = builder.open_batch(BatchTemplate240.Itau_Cheq_OP_DOC_TED_PIX_CredCC)
+    lote_ted.header['...'] = ...  # Altere o header antes de adicionar o primeiro registro.
+    for ted in pagamentos_TED:
+        registro = RegistroCNAB240(RecordTemplate240.Itau_SegA_Cheq_OP_DOC_TED_PIX_CredCC_misc)
+        registro.content['...'] = ...
+        builder.add_record(registro)  # Registro é gerado e pode ser descartado.
+    builder.close_batch()
+
+    builder.add(outro_lote)  # Lotes completos também podem ser adicionados de uma vez.
+
+    builder.finalize('remessa.rem')
+"""
+
+import os
+import shutil
+import tempfile
+
+from brbankingcnab import CNABInvalidOperationError, bake_cnab_string
+from brbankingcnab.cnab240 import SEGMENTO_A, ArquivoCNAB240, LoteCNAB240, CNAB240KeyError
+
+DEFAULT_MEMORY_BUDGET = 16 * 1024 * 1024  # Bytes de linhas geradas mantidos em memória antes de despejar em disco.
+
+
+class ArquivoCNAB240Builder:
+    """Monta um arquivo de remessa CNAB 240 gerando e despejando em disco as linhas à medida que são adicionadas.
+
+    header e trailer são os do arquivo de remessa e podem ser alterados até finalize(). O header de cada lote aberto
+    com open_batch() é gerado quando o primeiro registro é adicionado, ou em close_batch() se o lote ficar vazio.
+
+    memory_budget é o máximo, em bytes, de linhas geradas mantidas em memória. Com strict == True, como em make(),
+    campos vazios geram erro, aqui já no momento em que o bloco é adicionado.
+    """
+
+    def __init__(self, file_template, memory_budget=DEFAULT_MEMORY_BUDGET, strict=True, encoding='latin-1'):
+        self.memory_budget = memory_budget
+        self.strict = strict
+        self.encoding = encoding
+
+        # Arquivo vazio, usado apenas pelos templates de header e trailer. Seus lotes nunca são guardados.
+        self.file = ArquivoCNAB240(file_template)
+        self.header = self.file.header
+        self.trailer = self.file.trailer
+
+        self.spill = tempfile.TemporaryFile()
+        self.buffer = []
+        self.buffered = 0
+
+        self.batch_count = 0  # Lotes adicionados, usado no codigo_lote.
+        self.total_records = 2  # Header e trailer de arquivo entram na contagem de registros do arquivo.
+
+        # Estado do lote aberto por open_batch().
+        self.batch = None
+        self.batch_records = 0
+        self.batch_payment_value = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """Descarta o arquivo temporário. Chamado automaticamente por finalize()."""
+        self.spill.close()
+        self.buffer = []
+        self.buffered = 0
+
+    def _write(self, data: str):
+        """Guarda linhas geradas no buffer, despejando-o no arquivo temporário se passar do orçamento de memória."""
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.memory_budget:
+            self._flush()
+
+    def _flush(self):
+        self.spill.write(''.join(self.buffer).encode(self.encoding))
+        self.buffer = []
+        self.buffered = 0
+
+    def _set_batch_number(self, batch, number):
+        """Atualiza codigo_lote no header e trailer do lote. O contador só avança depois que o lote é aceito."""
+        for part, name in ((batch.header, 'header'), (batch.trailer, 'trailer')):
+            try:
+                part['codigo_lote']['val'] = number
+            except KeyError:
+                raise CNAB240KeyError(class_name=self.__class__.__name__, method_name='add(lote)',
+                                      template_name=batch.template,
+                                      field_name='codigo_lote',
+                                      message=f'O campo não foi encontrado no {name} de lote.')
+
+    def add(self, batch: LoteCNAB240):
+        """Adiciona um lote completo: numera, gera e despeja suas linhas. O lote pode ser descartado em seguida.
+
+        Se a geração falhar, por exemplo por um campo vazio com strict == True, nada é gravado e a numeração dos lotes
+        não avança.
+        """
+
+        if self.batch is not None:
+            self.close_batch()
+
+        number = self.batch_count + 1
+        self._set_batch_number(batch, number)
+
+        # Código de lote de cada registro é o do lote a que pertencem.
+        for record in batch.content:
+            record.content['codigo_lote']['val'] = number
+
+        # Totais do trailer recalculados a partir do conteúdo, como em add_record().
+        batch.update_record_count()
+        batch.update_total_payment_value()
+
+        data = batch.make(strict=self.strict)
+        self.batch_count = number
+        self._write(data)
+        self.total_records += batch.get_record_count()
+
+    def open_batch(self, batch_template) -> LoteCNAB240:
+        """Abre um lote para receber registros um a um com add_record(). Retorna o lote, para edição do header."""
+
+        if self.batch is not None:
+            self.close_batch()
+
+        batch = LoteCNAB240(batch_template)
+        self._set_batch_number(batch, self.batch_count + 1)
+        self.batch_count += 1
+        self.batch = batch
+        self.batch_records = 0
+        self.batch_payment_value = 0
+        return self.batch
+
+    def add_record(self, record):
+        """Adiciona um registro ao lote aberto, gerando sua linha na hora. O registro pode ser descartado em seguida.
+
+        Se a geração falhar, o registro não entra no lote: contagem, numero_registro e total do trailer continuam como
+        estavam, e o builder pode seguir recebendo registros.
+        """
+
+        if self.batch is None:
+            raise CNABInvalidOperationError(
+                class_name=self.__class__.__name__, method_name='add_record(registro)', extra=
+                'Abra um lote com open_batch() antes de adicionar registros.')
+
+        # O header do lote sai antes do primeiro registro.
+        header = ''
+        if self.batch_records == 0:
+            header = bake_cnab_string(self.batch.header, strict=self.strict).replace('\n', '\r\n')
+
+        number = self.batch_records + 1
+
+        try:
+            record.content['numero_registro']['val'] = number
+        except KeyError:
+            raise CNAB240KeyError(class_name=record.__class__.__name__, method_name='add_record(registro)',
+                                  template_name=record.template,
+                                  field_name='numero_registro',
+                                  message=f'O campo não foi encontrado no template do registro.')
+        record.content['codigo_lote']['val'] = self.batch_count
+
+        payment_value = self.batch_payment_value
+        if record.content['segmento']['val'] == SEGMENTO_A:
+            try:
+                payment_value += record.content['valor_pagamento']['val']
+            except KeyError:
+                raise CNAB240KeyError(class_name=record.__class__.__name__,
+                                      method_name='ArquivoCNAB240Builder.add_record()',
+                                      template_name=record.template,
+                                      field_name="RegistroCNAB240.content['valor_pagamento']['val']",
+                                      message=f'O campo não foi encontrado no registros.')
+
+        # Gera a linha antes de atualizar os totais, para que uma falha não deixe o lote inconsistente.
+        data = header + record.make(strict=self.strict)
+        self.batch_payment_value = payment_value
+        self.batch_records = number
+        self._write(data)
+
+    def close_batch(self):
+        """Fecha o lote aberto, gerando seu trailer com os totais acumulados."""
+
+        if self.batch is None:
+            return
+
+        data = ''
+        if self.batch_records == 0:
+            data = bake_cnab_string(self.batch.header, strict=self.strict).replace('\n', '\r\n')
+
+        self.batch.trailer['total_qtd_registros']['val'] = self.batch_records + 2
+        self.batch.trailer['total_valor_pagtos']['val'] = self.batch_payment_value
+        self._write(data + bake_cnab_string(self.batch.trailer, strict=self.strict).replace('\n', '\r\n'))
+
+        self.total_records += self.batch_records + 2
+        self.batch = None
+
+    def finalize(self, target):
+        """Fecha o lote aberto, atualiza o trailer de arquivo e grava a remessa em target.
+
+        target pode ser um caminho ou um arquivo aberto em modo binário. Header, linhas despejadas e trailer são
+        copiados em sequência, sem carregar o arquivo inteiro em memória.
+        """
+
+        self.close_batch()
+        self._flush()
+
+        self.trailer['total_qtd_lotes']['val'] = self.batch_count
+        self.trailer['total_qtd_registros']['val'] = self.total_records
+
+        header = bake_cnab_string(self.header, strict=self.strict).replace('\n', '\r\n').encode(self.encoding)
+        trailer = bake_cnab_string(self.trailer, strict=self.strict).replace('\n', '\r\n').encode(self.encoding)
+
+        if isinstance(target, (str, os.PathLike)):
+            with open(target, 'wb') as file:
+                self._stitch(file, header, trailer)
+        else:
+            self._stitch(target, header, trailer)
+
+        self.close()
+
+    def _stitch(self, file, header: bytes, trailer: bytes):
+        file.write(header)
+        self.spill.seek(0)
+        shutil.copyfileobj(self.spill, file)
+        file.write(trailer)
@@ -1,11 +1,17 @@
 import os
 import enum
+import mmap
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 
 from brbankingcnab import DATA_DIR, BlocoCNAB, CNABError, CNABInvalidTemplateError, CNABInvalidOperationError, \
-    BlockType, eval_ruleset
+    BlockType, eval_ruleset, bake_cnab_string, bake_values, compile_layout, line_payload
 
 SEGMENTO_A = 'A'  # Código do seguimento A.
 
+CNAB240_LINE_SIZE = 242  # 240 caracteres de dados mais o terminador '\r\n'.
+
 
 class CNAB240KeyError(CNABError):
     """Erro para campos inválidos ou ausentes no template de CNABs 240 ou durante a sua leitura e validação."""
@@ -15,6 +21,65 @@ class CNAB240KeyError(CNABError):
                          f' o campo {field_name}. {message}')
 
 
+# Linhas do arquivo em geração, entregues aos processos trabalhadores de ArquivoCNAB240.make_parallel() pelo
+# initializer do pool. Só é preenchida nos processos trabalhadores.
+_worker_blocks = None
+
+
+def _init_parallel_worker(blocks):
+    global _worker_blocks
+    _worker_blocks = blocks
+
+
+def _bake_payload(payload, strict):
+    if isinstance(payload, str):
+        return payload
+    template_path, values = payload
+    return bake_values(values, compile_layout(template_path), strict=strict)
+
+
+def _encode_line_range(start, end, strict, encoding, path=None, shm_name=None, blocks=None, payloads=None):
+    """Gera as linhas CNAB 240 de índices [start, end) do arquivo e as escreve na sua fatia do buffer de saída.
+
+    Executada nos processos trabalhadores de ArquivoCNAB240.make_parallel(). As linhas vêm de blocks, de payloads
+    (gerados por line_payload()) ou, sem nenhum dos dois, das herdadas pelo initializer do pool. A fatia é escrita no
+    arquivo path, mapeado em memória, ou no bloco de memória compartilhada shm_name. Sem nenhum dos dois, retorna os
+    bytes gerados.
+    """
+
+    if payloads is not None:
+        lines = [_bake_payload(payload, strict) for payload in payloads]
+    else:
+        if blocks is None:
+            blocks = [_worker_blocks[index] for index in range(start, end)]
+        lines = [bake_cnab_string(block, strict=strict) for block in blocks]
+
+    data = ''.join(lines).replace('\n', '\r\n')
+    data = data.encode(encoding)
+
+    # Os offsets foram calculados assumindo linhas de tamanho fixo. Qualquer desvio corromperia as fatias vizinhas.
+    if len(data) != (end - start) * CNAB240_LINE_SIZE:
+        raise CNABError(message=f'Linhas geradas não possuem {CNAB240_LINE_SIZE} bytes. Verifique os tamanhos dos '
+                                f'campos nos templates e se a codificação {encoding} usa um byte por carácter.')
+
+    offset = start * CNAB240_LINE_SIZE
+
+    if path is not None:
+        with open(path, 'r+b') as file:
+            with mmap.mmap(file.fileno(), 0) as buffer:
+                buffer[offset:offset + len(data)] = data
+    elif shm_name is not None:
+        shm = shared_memory.SharedMemory(name=shm_name)
+        try:
+            shm.buf[offset:offset + len(data)] = data
+        finally:
+            shm.close()
+    else:
+        return data
+
+    return len(data)
+
+
 class RecordTemplate240(enum.Enum):
     """Templates de tipos de registro CNAB 240 presentes e implementados.
 
@@ -220,15 +285,15 @@ class LoteCNAB240(BlocoCNAB):
                   f'Corrija o valor inicial de numero_registro para 0 (zero inteiro) nesse template.')
             raise e
 
-        # Incrementa valor total dos pagamentos do lote.
-        self.update_total_payment_value()
-
         # Código de lote de cada registro é o do lote a que pertemcem.
         record.content['codigo_lote']['val'] = self.header['codigo_lote']['val']
 
         # Adiciona registro ao lote.
         self.content.append(record)
 
+        # Atualiza valor total dos pagamentos do lote, já contando o registro adicionado.
+        self.update_total_payment_value()
+
         # Incrementa contagem de lotes no arquivo.
         self.update_record_count()
 
@@ -362,3 +427,75 @@ class ArquivoCNAB240(BlocoCNAB):
 
     def new_record_from_str(self, batch: LoteCNAB240, line: str) -> BlocoCNAB:
         return batch.parse_record_str(line)
+
+    def list_line_blocks(self) -> list:
+        """Lista, na ordem do arquivo, os dicts de campos de cada linha: header de arquivo, header de cada lote seguido
+        dos seus registros e trailer, e por fim o trailer de arquivo. A posição na lista dá o offset da linha."""
+
+        blocks = [self.header]
+        for batch in self.content:
+            blocks.append(batch.header)
+            blocks.extend(record.content for record in batch.content)
+            blocks.append(batch.trailer)
+        blocks.append(self.trailer)
+        return blocks
+
+    def make_parallel(self, strict=True, workers=None, path=None, encoding='latin-1', mp_context=None):
+        """Gera o arquivo CNAB em paralelo, direto num buffer pré-alocado.
+
+        Como toda linha tem exatamente CNAB240_LINE_SIZE bytes, o tamanho final e o offset de cada linha são conhecidos
+        antes da geração. As linhas são divididas em fatias contíguas, uma por processo trabalhador, e cada processo
+        gera a sua fatia e a escreve direto na posição final.
+
+        Se path for informado, o arquivo é criado já com o tamanho final, cada processo escreve sua fatia nele através
+        de mmap e o caminho é retornado. Senão, os processos escrevem num bloco de multiprocessing.shared_memory,
+        copiado para o bytearray retornado.
+
+        mp_context escolhe o método de início dos processos; o padrão é o da plataforma. Com fork, os trabalhadores
+        herdam as linhas pelo initializer do pool. Com spawn ou forkserver, serializar os dicts de campos custaria mais
+        que gerá-los, então cada trabalhador recebe da sua fatia apenas o resultado de line_payload(): a string em cache
+        ou o template e os valores de cada linha.
+
+        O resultado é idêntico a make(strict).encode(encoding). Com workers == 1 tudo é gerado no processo atual.
+        """
+
+        blocks = self.list_line_blocks()
+        total_size = len(blocks) * CNAB240_LINE_SIZE
+
+        workers = workers or os.cpu_count() or 1
+        chunk_size = -(-len(blocks) // workers)  # Divisão com arredondamento para cima.
+        ranges = [(start, min(start + chunk_size, len(blocks))) for start in range(0, len(blocks), chunk_size)]
+
+        if path is not None:
+            # Pré-aloca o arquivo no tamanho final para que os trabalhadores possam mapeá-lo por inteiro.
+            with open(path, 'wb') as file:
+                file.truncate(total_size)
+
+        if len(ranges) == 1:
+            data = _encode_line_range(0, len(blocks), strict, encoding, path, blocks=blocks)
+            return path if path is not None else bytearray(data)
+
+        context = mp_context or multiprocessing.get_context()
+        inherit = context.get_start_method() == 'fork'
+        shm = None if path is not None else shared_memory.SharedMemory(create=True, size=total_size)
+
+        try:
+            with ProcessPoolExecutor(max_workers=len(ranges), mp_context=context,
+                                     initializer=_init_parallel_worker if inherit else None,
+                                     initargs=(blocks,) if inherit else ()) as executor:
+                futures = [executor.submit(_encode_line_range, start, end, strict, encoding, path,
+                                           shm.name if shm is not None else None, None,
+                                           None if inherit else [line_payload(block, strict)
+                                                                 for block in blocks[start:end]])
+                           for start, end in ranges]
+                for future in futures:
+                    future.result()
+
+            if shm is not None:
+                return bytearray(shm.buf[:total_size])
+            return path
+
+        finally:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
@@ -0,0 +1,302 @@
+"""Detecção de pagamentos duplicados entre arquivos de remessa CNAB 240.
+
+Cada registro de segmento A recebe uma impressão digital canônica, calculada a partir de campos configuráveis. As
+impressões dos pagamentos já enviados ficam num índice sqlite local, com um filtro de Bloom em memória na frente para
+que a maioria das consultas nem chegue ao disco.
+
+Exemplo de uso:
+
+    with DuplicatePaymentDetector('pagamentos.sqlite') as detector:
+        detector.validate(arquivo_cnab)  # Dispara CNABDuplicatePaymentError se algum pagamento já foi enviado.
+        final_cnab_string = arquivo_cnab.make()
+        detector.register(arquivo_cnab)  # Verifica de novo e grava, atomicamente entre processos.
+"""
+
+import contextlib
+import hashlib
+import math
+import sqlite3
+
+from brbankingcnab import BlockType, CNABError
+from brbankingcnab.cnab240 import SEGMENTO_A, CNAB240KeyError
+
+# Campos do segmento A que identificam um pagamento: favorecido, valor, data e número atribuído pela empresa.
+DEFAULT_FINGERPRINT_FIELDS = ('banco_favor_codigo', 'agencia', 'conta', 'dac', 'valor_pagamento', 'data_pagamento',
+                              'seu_numero')
+
+FINGERPRINT_SIZE = 16  # Tamanho em bytes da impressão digital, um hash blake2b.
+
+_SQL_QUERY_CHUNK = 500  # Máximo de parâmetros por consulta IN (...), abaixo do limite do sqlite.
+
+
+class CNABDuplicatePaymentError(CNABError):
+    """Exceção lançada quando um pagamento já registrado no índice de duplicidade é enviado novamente."""
+
+    def __init__(self, records):
+        msg = f'\n\t{len(records)} pagamento(s) duplicado(s) encontrado(s):'
+        for record in records:
+            msg += f"\n\t\tseu_numero={record.content['seu_numero']['val']!r}, " \
+                   f"valor_pagamento={record.content['valor_pagamento']['val']!r}"
+        super().__init__(msg)
+        self.records = records
+
+
+class BloomFilter:
+    """Filtro de Bloom sobre impressões digitais já calculadas.
+
+    As posições dos bits saem dos próprios bytes da impressão digital por hashing duplo, sem hash adicional. Falsos
+    positivos são possíveis, falsos negativos não.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(capacity, 1)
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.num_hashes = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, fingerprint: bytes):
+        h1 = int.from_bytes(fingerprint[:8], 'little')
+        h2 = int.from_bytes(fingerprint[8:16], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.num_hashes))
+
+    def add(self, fingerprint: bytes):
+        for pos in self._positions(fingerprint):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, fingerprint: bytes) -> bool:
+        for pos in self._positions(fingerprint):
+            if not self.bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+
+class DuplicatePaymentDetector:
+    """Índice persistente de pagamentos enviados, para impedir que um mesmo pagamento saia em dois arquivos.
+
+    path é o arquivo sqlite do índice, criado se não existir. fields define os campos do registro de segmento A que
+    compõem a impressão digital e fica gravado no índice: abrir um índice existente com outros campos gera erro, pois
+    as impressões não seriam comparáveis. capacity e error_rate dimensionam o filtro de Bloom em memória, que dobra de
+    tamanho sempre que o índice passa de capacity pagamentos.
+
+    Vários processos podem usar o mesmo índice. Cada impressão gravada recebe um número de sequência, e antes de cada
+    consulta o detector acrescenta ao seu filtro de Bloom as impressões gravadas por outros processos desde a última
+    consulta, de forma que o filtro nunca deixa passar um pagamento já registrado.
+
+    find_duplicates(), validate() e register() aceitam um LoteCNAB240 ou um ArquivoCNAB240. register() verifica e grava
+    todos os pagamentos do bloco numa única transação exclusiva.
+    """
+
+    def __init__(self, path, fields=DEFAULT_FINGERPRINT_FIELDS, capacity=1_000_000, error_rate=0.001):
+        self.path = path
+        self.fields = tuple(fields)
+        self.error_rate = error_rate
+
+        # Transações controladas explicitamente, para que register() possa usar BEGIN IMMEDIATE.
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+
+        # Transação exclusiva: vários processos podem abrir juntos um índice novo.
+        with self._transaction('IMMEDIATE'):
+            self.connection.execute('CREATE TABLE IF NOT EXISTS fingerprints '
+                                    '(fp BLOB PRIMARY KEY, seq INTEGER NOT NULL) WITHOUT ROWID')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS fingerprints_seq ON fingerprints (seq)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS bloom (size INTEGER, num_hashes INTEGER, seq INTEGER, '
+                                    'bits BLOB)')
+            stored = self._store_fields()
+
+        if stored != ','.join(self.fields):
+            self.connection.close()
+            self.connection = None
+            raise CNABError(message=f'O índice {path} foi criado com os campos {stored}, incompatíveis com '
+                                    f'{",".join(self.fields)}.')
+
+        # Leituras numa mesma transação, para que contagem, filtro e número de sequência sejam consistentes.
+        with self._transaction():
+            total = self.connection.execute('SELECT COUNT(*) FROM fingerprints').fetchone()[0]
+            self.capacity = max(capacity, 2 * total)
+            self.bloom, self.seq = self._load_bloom()
+            self.count = self.connection.execute('SELECT COUNT(*) FROM fingerprints WHERE seq <= ?',
+                                                 (self.seq,)).fetchone()[0]
+        self._sync()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """Salva o filtro de Bloom junto do índice, para não precisar reconstruí-lo na próxima abertura, e fecha.
+        Chamadas repetidas não fazem nada."""
+
+        if self.connection is None:
+            return
+        with self._transaction():
+            self.connection.execute('DELETE FROM bloom')
+            self.connection.execute('INSERT INTO bloom (size, num_hashes, seq, bits) VALUES (?, ?, ?, ?)',
+                                    (self.bloom.size, self.bloom.num_hashes, self.seq, bytes(self.bloom.bits)))
+        self.connection.close()
+        self.connection = None
+
+    @contextlib.contextmanager
+    def _transaction(self, mode='DEFERRED'):
+        self.connection.execute(f'BEGIN {mode}')
+        try:
+            yield
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.connection.execute('COMMIT')
+
+    def _max_seq(self) -> int:
+        return self.connection.execute('SELECT COALESCE(MAX(seq), 0) FROM fingerprints').fetchone()[0]
+
+    def _rebuild_bloom(self):
+        """Cria um filtro de Bloom para capacity e o preenche com todas as impressões do índice."""
+        self.bloom = BloomFilter(self.capacity, self.error_rate)
+        for (fingerprint,) in self.connection.execute('SELECT fp FROM fingerprints'):
+            self.bloom.add(fingerprint)
+
+    def _load_bloom(self):
+        """Carrega o filtro de Bloom salvo no índice ou o reconstrói percorrendo todas as impressões.
+
+        Retorna o filtro e o número de sequência até o qual ele está atualizado. O filtro salvo só é aproveitado se
+        tiver tamanho suficiente para capacity. Impressões gravadas depois dele são acrescentadas por _sync().
+        """
+
+        bloom = BloomFilter(self.capacity, self.error_rate)
+        row = self.connection.execute('SELECT size, num_hashes, seq, bits FROM bloom').fetchone()
+        if row is not None and row[0] >= bloom.size:
+            bloom.size, bloom.num_hashes, bloom.bits = row[0], row[1], bytearray(row[3])
+            return bloom, row[2]
+
+        self._rebuild_bloom()
+        return self.bloom, self._max_seq()
+
+    def _sync(self):
+        """Acrescenta ao filtro de Bloom as impressões gravadas, por este ou outro processo, desde a última sincronia.
+
+        Se o índice passar de capacity, dobra capacity e reconstrói o filtro, mantendo a taxa de falsos positivos.
+        """
+
+        new = self.connection.execute('SELECT fp, seq FROM fingerprints WHERE seq > ?', (self.seq,)).fetchall()
+        if not new:
+            return
+
+        self.count += len(new)
+        self.seq = max(seq for _, seq in new)
+
+        if self.count > self.capacity:
+            self.capacity = 2 * self.count
+            self._rebuild_bloom()
+        else:
+            for fingerprint, _ in new:
+                self.bloom.add(fingerprint)
+
+    def _store_fields(self) -> str:
+        """Grava os campos da impressão digital se o índice for novo e retorna os campos gravados no índice."""
+        self.connection.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('fields', ?)",
+                                (','.join(self.fields),))
+        return self.connection.execute("SELECT value FROM meta WHERE key = 'fields'").fetchone()[0]
+
+    def fingerprint(self, record) -> bytes:
+        """Calcula a impressão digital canônica de um registro de segmento A.
+
+        Campos numéricos são normalizados como inteiros e alfanuméricos truncados no tamanho do campo e sem espaços nas
+        pontas, para que um registro montado à mão e o mesmo registro lido de um arquivo gerem a mesma impressão.
+        """
+
+        parts = []
+        for name in self.fields:
+            try:
+                field = record.content[name]
+            except KeyError:
+                raise CNAB240KeyError(class_name=self.__class__.__name__, method_name='fingerprint(record)',
+                                      template_name=record.template, field_name=name,
+                                      message='O campo não foi encontrado no template do registro.')
+            val = field['val']
+            if val is None:
+                parts.append('')
+            elif field['type'] == 'num' and str(val).strip().isdigit():
+                parts.append(str(int(val)))
+            else:
+                parts.append(str(val)[:field['size']].strip())
+
+        canonical = '\x1f'.join(parts).encode('utf-8')
+        return hashlib.blake2b(canonical, digest_size=FINGERPRINT_SIZE).digest()
+
+    def _payment_records(self, block):
+        """Itera os registros de segmento A de um lote ou de todos os lotes de um arquivo."""
+        batches = block.content if block.block_type == BlockType.Arquivo else [block]
+        for batch in batches:
+            for record in batch.content:
+                if record.content['segmento']['val'] == SEGMENTO_A:
+                    yield record
+
+    def _stored(self, fingerprints) -> set:
+        """Consulta no sqlite quais das impressões recebidas já estão no índice."""
+        fingerprints = list(fingerprints)
+        found = set()
+        for start in range(0, len(fingerprints), _SQL_QUERY_CHUNK):
+            chunk = fingerprints[start:start + _SQL_QUERY_CHUNK]
+            query = f"SELECT fp FROM fingerprints WHERE fp IN ({','.join('?' * len(chunk))})"
+            found.update(row[0] for row in self.connection.execute(query, chunk))
+        return found
+
+    def _find_duplicates(self, records) -> list:
+        """Separa, de uma lista de (impressão, registro), os registros já presentes no índice ou repetidos na lista."""
+
+        seen = set()
+        repeated = []
+        candidates = []
+        for fingerprint, record in records:
+            if fingerprint in seen:
+                repeated.append(record)
+                continue
+            seen.add(fingerprint)
+            if fingerprint in self.bloom:
+                candidates.append((fingerprint, record))
+
+        stored = self._stored(fingerprint for fingerprint, _ in candidates)
+        duplicates = [record for fingerprint, record in candidates if fingerprint in stored]
+        return duplicates + repeated
+
+    def find_duplicates(self, block) -> list:
+        """Retorna os registros de segmento A do lote/arquivo que já estão no índice ou que se repetem no próprio bloco.
+
+        O filtro de Bloom é sincronizado com o índice antes da consulta, e só as impressões que passam por ele são
+        confirmadas no sqlite, numa consulta em lote.
+        """
+
+        self._sync()
+        return self._find_duplicates([(self.fingerprint(record), record) for record in self._payment_records(block)])
+
+    def validate(self, block):
+        """Dispara CNABDuplicatePaymentError se o lote/arquivo contiver algum pagamento duplicado."""
+        duplicates = self.find_duplicates(block)
+        if duplicates:
+            raise CNABDuplicatePaymentError(duplicates)
+
+    def register(self, block, check=True):
+        """Grava no índice todos os pagamentos de segmento A do lote/arquivo.
+
+        A verificação e a gravação acontecem na mesma transação exclusiva, então dois processos não conseguem registrar
+        o mesmo pagamento. Com check == True, se algum pagamento já estiver no índice ou se repetir no bloco, nada é
+        gravado e CNABDuplicatePaymentError é lançada. Com check == False, os já registrados são ignorados.
+        """
+
+        records = [(self.fingerprint(record), record) for record in self._payment_records(block)]
+
+        with self._transaction('IMMEDIATE'):
+            self._sync()
+            if check:
+                duplicates = self._find_duplicates(records)
+                if duplicates:
+                    raise CNABDuplicatePaymentError(duplicates)
+
+            seq = self._max_seq()
+            self.connection.executemany('INSERT OR IGNORE INTO fingerprints (fp, seq) VALUES (?, ?)',
+                                        ((fingerprint, seq + index)
+                                         for index, (fingerprint, _) in enumerate(records, start=1)))
+
+        self._sync()
@@ -0,0 +1,491 @@
+"""Serviço HTTP local que mantém processos Python aquecidos para gerar, interpretar, validar e resumir CNABs 240.
+
+Chamar a biblioteca a partir de outras linguagens iniciando um processo Python por arquivo paga, a cada vez, o início
+do interpretador, a importação do pacote e a leitura dos templates. Este serviço carrega tudo isso uma vez, em cada
+processo do pool de trabalhadores, e atende requisições concorrentes: cada conexão é tratada numa thread, e o trabalho
+pesado vai para o pool de processos.
+
+Uso:
+
+    python -m brbankingcnab.server --host 127.0.0.1 --port 8240 --workers 4
+
+Rotas:
+
+    POST /generate  :  corpo JSON descrevendo o arquivo (ver generate_cnab240()), responde a remessa CNAB
+    POST /parse     :  corpo com o CNAB, responde JSON com os valores dos campos de cada linha
+    POST /validate  :  corpo com o CNAB, responde JSON {"valid": bool, "errors": [...]}
+    POST /summary   :  corpo com o CNAB, responde JSON com o resumo de summarize_cnab240()
+    GET  /metrics   :  contagens, latências e vazão por rota
+    GET  /health    :  responde 200 se o serviço está no ar
+
+Corpos de requisição podem vir com Content-Length ou Transfer-Encoding: chunked. São gravados em blocos num arquivo
+temporário, e o processo do pool recebe apenas o caminho. O processo grava a resposta noutro arquivo temporário, que é
+enviado em blocos com Content-Length. /generate monta a remessa com ArquivoCNAB240Builder direto nesse arquivo, mantendo
+o limite de memória do builder, e /summary lê o CNAB linha a linha. /parse e /validate carregam o CNAB inteiro no
+processo do pool, pois parse_cnab_string() trabalha sobre a string completa. O texto CNAB é trafegado em latin-1.
+"""
+
+import argparse
+import collections
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from brbankingcnab import CNABError, compile_layout, parse_cnab_string, read_template
+from brbankingcnab.builder import ArquivoCNAB240Builder
+from brbankingcnab.cnab240 import SEGMENTO_A, BatchTemplate240, FileTemplate240, RecordTemplate240, RegistroCNAB240
+from brbankingcnab.summary import summarize_cnab240
+
+ENCODING = 'latin-1'  # Codificação do texto CNAB nas requisições e respostas.
+
+IO_CHUNK_SIZE = 64 * 1024  # Tamanho dos blocos lidos da requisição e dos chunks enviados na resposta.
+
+LATENCY_WINDOW = 1024  # Quantidade de latências recentes mantidas por rota para os percentis.
+
+UNKNOWN_ROUTE = '(desconhecida)'  # Chave única das métricas para requisições a rotas que não existem.
+
+
+class CNABRequestError(CNABError):
+    """Exceção lançada quando o corpo de uma requisição ao serviço é inválido."""
+    pass
+
+
+def _warm_up():
+    """Inicializador dos processos do pool: lê e compila todos os templates antes da primeira requisição."""
+    for template in RecordTemplate240:
+        compile_layout(template.value['path'])
+    for template in list(BatchTemplate240) + list(FileTemplate240):
+        if template.value['path']:
+            for part in ('header', 'trailer'):
+                compile_layout(template.value['path'].format(part))
+    return read_template.cache_info().currsize
+
+
+def _template(enum_class, name):
+    """Retorna o template de enum_class com esse nome. Templates ainda sem arquivo (path None) não são aceitos."""
+    template = enum_class.__members__.get(name)
+    if template is None or not template.value.get('path'):
+        valid = ', '.join(item.name for item in enum_class if item.value.get('path'))
+        raise CNABRequestError(message=f"Template '{name}' inválido para {enum_class.__name__}. Valores válidos são "
+                                       f"{valid}.")
+    return template
+
+
+def _expect(value, kind, where):
+    """Verifica o tipo de um item da descrição do arquivo, lançando CNABRequestError se for outro."""
+    if not isinstance(value, kind):
+        names = {dict: 'objeto', list: 'lista', str: 'texto', bool: 'booleano'}
+        raise CNABRequestError(message=f"{where} deve ser {names[kind]}, não {json.dumps(value)[:50]}.")
+    return value
+
+
+def _check_value(field: dict, val, where):
+    """Verifica se val cabe no campo: inteiro não negativo com até size dígitos em campos 'num', texto em latin-1 em
+    campos 'alfanum'. Outros valores gerariam linhas inválidas ou erros durante a geração."""
+
+    if field['type'] == 'num':
+        if not isinstance(val, int) or isinstance(val, bool) or val < 0 or len(str(val)) > field['size']:
+            raise CNABRequestError(message=f"{where} deve ser um inteiro não negativo com até {field['size']} "
+                                           f"dígitos, não {json.dumps(val)[:50]}.")
+    else:
+        if not isinstance(val, str):
+            raise CNABRequestError(message=f"{where} deve ser texto, não {json.dumps(val)[:50]}.")
+        try:
+            val.encode(ENCODING)
+        except UnicodeEncodeError:
+            raise CNABRequestError(message=f"{where} tem caracteres que não existem em {ENCODING}.")
+
+
+def _set_fields(block: dict, values: dict, where):
+    for key, val in _expect(values, dict, where).items():
+        if key not in block:
+            raise CNABRequestError(message=f"Campo '{key}' não existe no template.")
+        _check_value(block[key], val, f'{where}.{key}')
+        block[key]['val'] = val
+
+
+def generate_cnab240(spec: dict, target):
+    """Gera uma remessa CNAB 240 a partir de uma descrição em dict e a grava em target, um caminho ou um arquivo aberto
+    em modo binário. A descrição tem o formato:
+
+    {
+        "file_template": "FileItau",
+        "strict": true,
+        "header": {"nome_empresa": "...", ...},
+        "trailer": {...},
+        "batches": [
+            {
+                "template": "Itau_Cheq_OP_DOC_TED_PIX_CredCC",
+                "header": {...},
+                "trailer": {...},
+                "records": [
+                    {"template": "Itau_SegA_Cheq_OP_DOC_TED_PIX_CredCC_misc", "fields": {...}},
+                    ...
+                ]
+            }
+        ]
+    }
+
+    Campos de contagem, totais, codigo_lote e numero_registro são preenchidos automaticamente. Uma descrição fora
+    desse formato, ou com valores que não cabem nos campos, lança CNABRequestError.
+    """
+
+    _expect(spec, dict, 'A descrição do arquivo')
+    builder = ArquivoCNAB240Builder(
+        _template(FileTemplate240, _expect(spec.get('file_template', 'FileItau'), str, 'file_template')),
+        strict=_expect(spec.get('strict', True), bool, 'strict'), encoding=ENCODING)
+    with builder:
+        _set_fields(builder.header, spec.get('header', {}), 'header')
+        _set_fields(builder.trailer, spec.get('trailer', {}), 'trailer')
+
+        for batch_index, batch_spec in enumerate(_expect(spec.get('batches', []), list, 'batches')):
+            where = f'batches[{batch_index}]'
+            _expect(batch_spec, dict, where)
+            batch = builder.open_batch(
+                _template(BatchTemplate240, _expect(batch_spec.get('template'), str, f'{where}.template')))
+            _set_fields(batch.header, batch_spec.get('header', {}), f'{where}.header')
+            _set_fields(batch.trailer, batch_spec.get('trailer', {}), f'{where}.trailer')
+
+            for record_index, record_spec in enumerate(_expect(batch_spec.get('records', []), list,
+                                                               f'{where}.records')):
+                record_where = f'{where}.records[{record_index}]'
+                _expect(record_spec, dict, record_where)
+                record = RegistroCNAB240(
+                    _template(RecordTemplate240, _expect(record_spec.get('template'), str, f'{record_where}.template')))
+                _set_fields(record.content, record_spec.get('fields', {}), f'{record_where}.fields')
+                builder.add_record(record)
+            builder.close_batch()
+
+        builder.finalize(target)
+
+
+def _values(block: dict) -> dict:
+    return {key: field['val'] for key, field in block.items()}
+
+
+def parse_cnab240(data: bytes, file_template='FileItau') -> dict:
+    """Interpreta um CNAB 240 e retorna os valores dos campos de header, trailer, lotes e registros."""
+
+    cnab_file = parse_cnab_string(data.decode(ENCODING), 240, _template(FileTemplate240, file_template))
+    return {
+        'header': _values(cnab_file.header),
+        'trailer': _values(cnab_file.trailer),
+        'batches': [{'header': _values(batch.header),
+                     'trailer': _values(batch.trailer),
+                     'records': [_values(record.content) for record in batch.content]}
+                    for batch in cnab_file.content],
+    }
+
+
+def validate_cnab240(data: bytes, file_template='FileItau') -> dict:
+    """Verifica se um CNAB 240 é interpretável, não tem campos vazios e se os totais dos trailers conferem."""
+
+    try:
+        cnab_file = parse_cnab_string(data.decode(ENCODING), 240, _template(FileTemplate240, file_template))
+        cnab_file.make(strict=True)
+    except (CNABError, ValueError, IndexError, KeyError) as e:
+        return {'valid': False, 'errors': [str(e).strip()]}
+
+    errors = []
+    total_records = 2
+    for batch in cnab_file.content:
+        number = batch.header['codigo_lote']['val']
+        records = len(batch.content) + 2
+        payments = sum(record.content['valor_pagamento']['val'] for record in batch.content
+                       if record.content['segmento']['val'] == SEGMENTO_A)
+        if batch.trailer['total_qtd_registros']['val'] != records:
+            errors.append(f'Lote {number}: total_qtd_registros deveria ser {records}.')
+        if batch.trailer['total_valor_pagtos']['val'] != payments:
+            errors.append(f'Lote {number}: total_valor_pagtos deveria ser {payments}.')
+        total_records += records
+
+    if cnab_file.trailer['total_qtd_lotes']['val'] != len(cnab_file.content):
+        errors.append(f'Arquivo: total_qtd_lotes deveria ser {len(cnab_file.content)}.')
+    if cnab_file.trailer['total_qtd_registros']['val'] != total_records:
+        errors.append(f'Arquivo: total_qtd_registros deveria ser {total_records}.')
+
+    return {'valid': not errors, 'errors': errors}
+
+
+def summarize(data) -> dict:
+    """Resume um CNAB 240 com summarize_cnab240(), convertendo datas para texto ISO. data pode ser bytes ou um arquivo
+    aberto em modo binário, lido linha a linha."""
+    if isinstance(data, bytes):
+        data = io.BytesIO(data)
+    summary = summarize_cnab240(io.TextIOWrapper(data, encoding=ENCODING, newline=''))
+    for key in ('data_pagamento', 'data_efetiva'):
+        summary[key] = [date.isoformat() if date else None for date in summary[key]]
+    return summary
+
+
+def _write_json(result, output):
+    text = io.TextIOWrapper(output, encoding='utf-8')
+    json.dump(result, text)
+    text.detach()
+
+
+def _generate_route(body, output):
+    try:
+        spec = json.load(body)
+    except ValueError as e:
+        raise CNABRequestError(message=f'JSON inválido: {e}')
+    generate_cnab240(spec, output)
+
+
+def _parse_route(body, output, file_template='FileItau'):
+    _write_json(parse_cnab240(body.read(), file_template), output)
+
+
+def _validate_route(body, output, file_template='FileItau'):
+    _write_json(validate_cnab240(body.read(), file_template), output)
+
+
+def _summary_route(body, output):
+    _write_json(summarize(body), output)
+
+
+def _run_route(function, body_path, output_path, options):
+    """Executado no pool: lê o corpo da requisição de body_path e grava a resposta em output_path."""
+    with open(body_path, 'rb') as body, open(output_path, 'wb') as output:
+        function(body, output, **options)
+
+
+class Metrics:
+    """Contadores de requisições por rota, compartilhados entre as threads do servidor."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.routes = {}
+
+    def record(self, route, latency, bytes_in, bytes_out, error):
+        with self.lock:
+            stats = self.routes.get(route)
+            if stats is None:
+                stats = self.routes[route] = {'count': 0, 'errors': 0, 'bytes_in': 0, 'bytes_out': 0,
+                                              'latency_total': 0.0, 'latency_max': 0.0,
+                                              'recent': collections.deque(maxlen=LATENCY_WINDOW)}
+            stats['count'] += 1
+            stats['errors'] += int(error)
+            stats['bytes_in'] += bytes_in
+            stats['bytes_out'] += bytes_out
+            stats['latency_total'] += latency
+            stats['latency_max'] = max(stats['latency_max'], latency)
+            stats['recent'].append(latency)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            uptime = time.time() - self.started
+            routes = {}
+            for route, stats in self.routes.items():
+                recent = sorted(stats['recent'])
+
+                def percentile(p):
+                    return round(recent[min(int(len(recent) * p), len(recent) - 1)] * 1000, 3)
+
+                routes[route] = {
+                    'count': stats['count'],
+                    'errors': stats['errors'],
+                    'requests_per_second': round(stats['count'] / uptime, 3),
+                    'bytes_in': stats['bytes_in'],
+                    'bytes_out': stats['bytes_out'],
+                    'latency_ms': {'avg': round(stats['latency_total'] / stats['count'] * 1000, 3),
+                                   'max': round(stats['latency_max'] * 1000, 3),
+                                   'p50': percentile(0.50), 'p95': percentile(0.95), 'p99': percentile(0.99)},
+                }
+            return {'uptime_seconds': round(uptime, 3), 'routes': routes}
+
+
+class CNABRequestHandler(BaseHTTPRequestHandler):
+    """Trata as requisições HTTP, delegando o processamento dos CNABs ao pool de processos do servidor."""
+
+    protocol_version = 'HTTP/1.1'
+
+    # Rota -> (função executada no pool, Content-Type da resposta, opções aceitas na query string).
+    routes = {
+        '/generate': (_generate_route, f'text/plain; charset={ENCODING}', ()),
+        '/parse': (_parse_route, 'application/json; charset=utf-8', ('file_template',)),
+        '/validate': (_validate_route, 'application/json; charset=utf-8', ('file_template',)),
+        '/summary': (_summary_route, 'application/json; charset=utf-8', ()),
+    }
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+    def read_body(self, path) -> int:
+        """Grava o corpo da requisição em path, em blocos, com Content-Length ou Transfer-Encoding: chunked. Retorna o
+        tamanho do corpo."""
+
+        size = 0
+        with open(path, 'wb') as body:
+            try:
+                if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+                    while True:
+                        remaining = int(self.rfile.readline().split(b';')[0].strip(), 16)
+                        if remaining == 0:
+                            self.rfile.readline()
+                            break
+                        size += self.copy_body(body, remaining)
+                        self.rfile.readline()
+                else:
+                    size = self.copy_body(body, int(self.headers.get('Content-Length', 0)))
+            except ValueError:
+                raise CNABRequestError(message='Tamanho do corpo da requisição inválido.')
+        return size
+
+    def copy_body(self, body, remaining: int) -> int:
+        size = remaining
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, IO_CHUNK_SIZE))
+            if not chunk:
+                raise CNABRequestError(message='Corpo da requisição incompleto.')
+            body.write(chunk)
+            remaining -= len(chunk)
+        return size
+
+    def send_file(self, content_type: str, path) -> int:
+        """Envia o arquivo em path como resposta 200, copiando-o em blocos de IO_CHUNK_SIZE. Retorna o tamanho."""
+        size = os.path.getsize(path)
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        with open(path, 'rb') as file:
+            shutil.copyfileobj(file, self.wfile, IO_CHUNK_SIZE)
+        return size
+
+    def send_json(self, status: int, content, close=False) -> int:
+        """Envia content em JSON. Com close == True, fecha a conexão em seguida, para respostas enviadas sem que o corpo
+        da requisição tenha sido lido."""
+        data = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        if close:
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(data)
+        return len(data)
+
+    def options(self, route, query) -> dict:
+        accepted = self.routes[route][2]
+        return {key: values[-1] for key, values in urllib.parse.parse_qs(query).items() if key in accepted}
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self.send_json(200, self.server.metrics.snapshot())
+        elif self.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        else:
+            self.send_json(404, {'error': f'Rota {self.path} não existe.'}, close=True)
+
+    def do_POST(self):
+        started = time.perf_counter()
+        route, _, query = self.path.partition('?')
+        status, bytes_in, bytes_out = 500, 0, 0
+
+        try:
+            if route not in self.routes:
+                status = 404
+                bytes_out = self.send_json(status, {'error': f'Rota {route} não existe.'}, close=True)
+                route = UNKNOWN_ROUTE
+                return
+
+            function, content_type, _ = self.routes[route]
+            with tempfile.TemporaryDirectory(prefix='brbankingcnab-') as directory:
+                body_path = os.path.join(directory, 'request')
+                output_path = os.path.join(directory, 'response')
+                consumed = False
+                try:
+                    bytes_in = self.read_body(body_path)
+                    consumed = True
+                    self.server.run(_run_route, function, body_path, output_path, self.options(route, query))
+                    status = 200
+                except CNABRequestError as e:
+                    status, error = 400, str(e).strip()
+                except (CNABError, ValueError, KeyError, IndexError) as e:
+                    status, error = 422, str(e).strip()
+                except Exception as e:
+                    self.log_error('Erro ao processar %s: %r', route, e)
+                    status, error = 500, f'Erro interno: {e.__class__.__name__}: {e}'
+
+                if status == 200:
+                    bytes_out = self.send_file(content_type, output_path)
+                else:
+                    bytes_out = self.send_json(status, {'error': error}, close=not consumed)
+
+        finally:
+            self.server.metrics.record(route, time.perf_counter() - started, bytes_in, bytes_out, status != 200)
+
+
+class CNABServer(ThreadingHTTPServer):
+    """Servidor HTTP com pool de processos aquecidos. Cada conexão é atendida numa thread."""
+
+    daemon_threads = True
+
+    def __init__(self, address, workers=None, quiet=False):
+        super().__init__(address, CNABRequestHandler)
+        self.quiet = quiet
+        self.metrics = Metrics()
+        self.workers = workers or os.cpu_count() or 1
+        self.pool_lock = threading.Lock()
+        self.pool = self._new_pool()
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_up)
+
+        # Força a criação e o aquecimento dos processos antes da primeira requisição.
+        for future in [pool.submit(_warm_up) for _ in range(self.workers)]:
+            future.result()
+        return pool
+
+    def run(self, function, *args):
+        """Executa function no pool e retorna seu resultado. Se um processo do pool morrer, o pool é recriado para as
+        próximas requisições e BrokenProcessPool é relançada."""
+
+        pool = self.pool
+        try:
+            return pool.submit(function, *args).result()
+        except BrokenProcessPool:
+            with self.pool_lock:
+                # Outra thread pode já ter recriado o pool.
+                if self.pool is pool:
+                    self.pool = self._new_pool()
+            pool.shutdown(wait=False)
+            raise
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serviço local de geração e leitura de CNAB 240.')
+    parser.add_argument('--host', default='127.0.0.1', help='Endereço de escuta. Padrão: 127.0.0.1.')
+    parser.add_argument('--port', type=int, default=8240, help='Porta de escuta. Padrão: 8240.')
+    parser.add_argument('--workers', type=int, default=None, help='Processos no pool. Padrão: número de CPUs.')
+    parser.add_argument('--quiet', action='store_true', help='Não registra cada requisição no stderr.')
+    args = parser.parse_args(argv)
+
+    server = CNABServer((args.host, args.port), workers=args.workers, quiet=args.quiet)
+    print(f'Servindo CNAB em http://{args.host}:{server.server_address[1]}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
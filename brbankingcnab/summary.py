@@ -0,0 +1,160 @@
+"""Resumo de arquivos de retorno CNAB 240 numa única passada, sem montar a árvore de blocos.
+
+parse_cnab_string() cria um LoteCNAB240 e um RegistroCNAB240 por linha, com todos os campos convertidos. Para painéis
+que só precisam de totais, summarize_cnab240() percorre as linhas cruas e fatia apenas as colunas necessárias dos
+registros de segmento A, usando os layouts compilados por compile_layout().
+
+Exemplo de uso:
+
+    with open('retorno.ret', 'r') as file:
+        summary = summarize_cnab240(file)
+    summary['batches'][1]['valor_pagamento']  # Soma dos pagamentos do lote 1.
+"""
+
+import datetime
+
+from brbankingcnab import CNABError, compile_layout, eval_ruleset
+from brbankingcnab.cnab240 import SEGMENTO_A, BatchTemplate240
+
+# Campos do segmento A lidos pelo resumo.
+SUMMARY_FIELDS = ('banco_favor_codigo', 'valor_pagamento', 'data_pagamento', 'data_efetiva', 'ocorrencias')
+
+
+def _segment_a_layouts(layout_code: int) -> list:
+    """Lista (regras, posições) de cada versão do segmento A do tipo de lote com o código de layout informado."""
+
+    for template in BatchTemplate240:
+        if layout_code in template.value['code'] and template.value.get('segments'):
+            layouts = []
+            for version in template.value['segments'][SEGMENTO_A]:
+                layout = compile_layout(version['layout'].value['path'])
+                layouts.append((version['rules'], tuple(layout[name][:2] for name in SUMMARY_FIELDS)))
+            return layouts
+
+    raise CNABError(message=f"Nenhum template de lote válido para o código {layout_code}.")
+
+
+def _date_key(line: str, start: int) -> str:
+    """Lê a data DDMMAAAA na posição start e a retorna como AAAAMMDD, que ordena como texto. Vazia se inválida."""
+    key = line[start + 4:start + 8] + line[start + 2:start + 4] + line[start:start + 2]
+    if not key.isdigit() or key == '00000000':
+        return ''
+    return key
+
+
+def _to_date(key: str):
+    try:
+        return datetime.date(int(key[:4]), int(key[4:6]), int(key[6:]))
+    except ValueError:
+        return None
+
+
+def _update_range(date_range: list, key: str):
+    # Só datas que mudariam o intervalo são validadas, e uma data inexistente como 31/02 não o substitui.
+    if key and (not date_range[0] or key < date_range[0] or key > date_range[1]) and _to_date(key) is not None:
+        if not date_range[0] or key < date_range[0]:
+            date_range[0] = key
+        if key > date_range[1]:
+            date_range[1] = key
+
+
+def _add_to_group(groups: dict, key, value: int):
+    group = groups.get(key)
+    if group is None:
+        groups[key] = [1, value]
+    else:
+        group[0] += 1
+        group[1] += value
+
+
+def _totals(groups: dict) -> dict:
+    return {key: {'count': count, 'valor_pagamento': value} for key, (count, value) in groups.items()}
+
+
+def summarize_cnab240(source) -> dict:
+    """Resume os registros de segmento A de um CNAB 240, lendo cada linha uma única vez.
+
+    source pode ser a string do arquivo ou qualquer iterável de linhas, como um arquivo aberto, que é lido sem ser
+    carregado inteiro. Retorna um dict com:
+
+    count, valor_pagamento  :  total de registros de segmento A e soma de valor_pagamento
+    batches                 :  por codigo_lote, dict com count e valor_pagamento
+    banks                   :  por banco_favor_codigo, dict com count e valor_pagamento
+    occurrences             :  por código de ocorrência de dois caracteres, dict com count e valor_pagamento. Um
+                               registro com várias ocorrências entra em cada uma delas
+    data_pagamento          :  tupla (menor, maior) com datetime.date, ignorando datas zeradas ou inválidas, ou
+                               (None, None) se não houver nenhuma válida
+    data_efetiva            :  idem, para a data de efetivação retornada pelo banco
+    """
+
+    if isinstance(source, str):
+        source = source.split('\n')
+
+    count = 0
+    total = 0
+    batches = {}
+    banks = {}
+    occurrences = {}
+    payment_range = ['', '']
+    effective_range = ['', '']
+
+    layouts = None
+    batch_number = None
+    layouts_by_code = {}
+
+    for line in source:
+        line = line.rstrip('\r\n')
+        if len(line) < 14:
+            continue
+
+        record_type = line[7]
+
+        # Header de lote define o layout dos registros seguintes.
+        if record_type == '1':
+            layout_code = int(line[13:16])
+            if layout_code not in layouts_by_code:
+                layouts_by_code[layout_code] = _segment_a_layouts(layout_code)
+            layouts = layouts_by_code[layout_code]
+            batch_number = int(line[3:7])
+            continue
+
+        if record_type != '3' or line[13:14].upper() != SEGMENTO_A:
+            continue
+
+        if layouts is None:
+            raise CNABError(message=f"Registro fora de um lote: \n{line}")
+
+        for rules, slices in layouts:
+            if eval_ruleset(line, rules):
+                break
+        else:
+            raise CNABError(message=f"Nenhum layout válido para \n{line}")
+
+        (bank_start, bank_end), (value_start, value_end), (payment_start, _), (effective_start, _), \
+            (occurrence_start, occurrence_end) = slices
+
+        value = int(line[value_start:value_end])
+
+        count += 1
+        total += value
+        _add_to_group(batches, batch_number, value)
+        _add_to_group(banks, int(line[bank_start:bank_end]), value)
+
+        codes = line[occurrence_start:occurrence_end].strip()
+        for index in range(0, len(codes), 2):
+            code = codes[index:index + 2].strip()
+            if code:
+                _add_to_group(occurrences, code, value)
+
+        _update_range(payment_range, _date_key(line, payment_start))
+        _update_range(effective_range, _date_key(line, effective_start))
+
+    return {
+        'count': count,
+        'valor_pagamento': total,
+        'batches': _totals(batches),
+        'banks': _totals(banks),
+        'occurrences': _totals(occurrences),
+        'data_pagamento': tuple(_to_date(key) for key in payment_range),
+        'data_efetiva': tuple(_to_date(key) for key in effective_range),
+    }
@@ -0,0 +1,55 @@
+import pytest
+
+from brbankingcnab.cnab240 import ArquivoCNAB240, LoteCNAB240, RegistroCNAB240, BatchTemplate240, FileTemplate240, \
+    RecordTemplate240
+
+
+def fill_required(block):
+    """Preenche os campos obrigatórios (null no template) e as datas de exemplo com valores válidos."""
+    for key, field in block.items():
+        if key in ('codigo_lote', 'numero_registro'):
+            continue
+        if field['val'] is None:
+            field['val'] = 1 if field['type'] == 'num' else 'X'
+        elif field['type'] == 'num' and isinstance(field['val'], str) and not field['val'].isdigit():
+            field['val'] = 1
+
+
+def new_record(number, segment='A'):
+    if segment == 'A':
+        record = RegistroCNAB240(RecordTemplate240.Itau_SegA_Cheq_OP_DOC_TED_PIX_CredCC_misc)
+        fill_required(record.content)
+        record.content['valor_pagamento']['val'] = 100 + number
+        record.content['seu_numero']['val'] = f'PG{number}'
+        record.content['data_pagamento']['val'] = f'{number % 28 + 1:02d}012026'
+        record.content['banco_favor_codigo']['val'] = [1, 33, 237][number % 3]
+    else:
+        record = RegistroCNAB240(RecordTemplate240.Itau_SegB_Cheq_OP_DOC_TED_CredCC)
+        fill_required(record.content)
+    return record
+
+
+def new_batch():
+    batch = LoteCNAB240(BatchTemplate240.Itau_Cheq_OP_DOC_TED_PIX_CredCC)
+    fill_required(batch.header)
+    batch.header['tipo_pagamento']['val'] = 20
+    return batch
+
+
+def new_file(batches=2, payments=5, first=0):
+    """Arquivo com batches lotes, cada um com payments pares de registros de segmento A e B."""
+    cnab_file = ArquivoCNAB240(FileTemplate240.FileItau)
+    fill_required(cnab_file.header)
+    for batch_index in range(batches):
+        batch = new_batch()
+        for index in range(payments):
+            number = first + batch_index * 1000 + index
+            batch.add(new_record(number))
+            batch.add(new_record(number, 'B'))
+        cnab_file.add(batch)
+    return cnab_file
+
+
+@pytest.fixture
+def cnab_file():
+    return new_file()
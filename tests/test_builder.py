@@ -0,0 +1,105 @@
+import io
+
+import pytest
+
+from brbankingcnab import CNABInvalidOperationError, CNABInvalidValueError
+from brbankingcnab.builder import ArquivoCNAB240Builder
+from brbankingcnab.cnab240 import ArquivoCNAB240, BatchTemplate240, FileTemplate240
+from conftest import fill_required, new_batch, new_file, new_record
+
+
+def build_with_records(batches, payments, segment_b=True, memory_budget=2000):
+    builder = ArquivoCNAB240Builder(FileTemplate240.FileItau, memory_budget=memory_budget)
+    fill_required(builder.header)
+    for batch_index in range(batches):
+        batch = builder.open_batch(BatchTemplate240.Itau_Cheq_OP_DOC_TED_PIX_CredCC)
+        fill_required(batch.header)
+        batch.header['tipo_pagamento']['val'] = 20
+        for index in range(payments):
+            builder.add_record(new_record(batch_index * 1000 + index))
+            if segment_b:
+                builder.add_record(new_record(batch_index * 1000 + index, 'B'))
+    output = io.BytesIO()
+    builder.finalize(output)
+    return output.getvalue()
+
+
+def test_add_record_matches_make():
+    expected = new_file(batches=3, payments=20).make().encode('latin-1')
+    assert build_with_records(3, 20) == expected
+
+
+def test_add_matches_make(tmp_path):
+    expected = new_file(batches=3, payments=20).make().encode('latin-1')
+
+    builder = ArquivoCNAB240Builder(FileTemplate240.FileItau, memory_budget=2000)
+    fill_required(builder.header)
+    for batch in new_file(batches=3, payments=20).content:
+        builder.add(batch)
+    path = tmp_path / 'remessa.rem'
+    builder.finalize(str(path))
+
+    assert path.read_bytes() == expected
+
+
+def test_add_and_add_record_agree_on_totals():
+    # Lote só com segmento A: o último registro também precisa entrar em total_valor_pagtos.
+    cnab_file = ArquivoCNAB240(FileTemplate240.FileItau)
+    fill_required(cnab_file.header)
+    batch = new_batch()
+    for index in range(5):
+        batch.add(new_record(index))
+    cnab_file.add(batch)
+    assert batch.trailer['total_valor_pagtos']['val'] == sum(range(100, 105))
+
+    builder = ArquivoCNAB240Builder(FileTemplate240.FileItau)
+    fill_required(builder.header)
+    builder.add(batch)
+    output = io.BytesIO()
+    builder.finalize(output)
+
+    assert output.getvalue() == build_with_records(1, 5, segment_b=False) == cnab_file.make().encode('latin-1')
+
+
+def test_add_record_requires_open_batch():
+    builder = ArquivoCNAB240Builder(FileTemplate240.FileItau)
+    with pytest.raises(CNABInvalidOperationError):
+        builder.add_record(new_record(0))
+    builder.close()
+
+
+def test_failed_record_leaves_batch_intact():
+    builder = ArquivoCNAB240Builder(FileTemplate240.FileItau)
+    fill_required(builder.header)
+    batch = builder.open_batch(BatchTemplate240.Itau_Cheq_OP_DOC_TED_PIX_CredCC)
+    fill_required(batch.header)
+    batch.header['tipo_pagamento']['val'] = 20
+
+    broken = new_record(1000)
+    broken.content['seu_numero']['val'] = None
+    with pytest.raises(CNABInvalidValueError):
+        builder.add_record(broken)
+
+    builder.add_record(new_record(0))
+    output = io.BytesIO()
+    builder.finalize(output)
+
+    assert output.getvalue() == build_with_records(1, 1, segment_b=False)
+
+
+def test_failed_batch_keeps_batch_numbering():
+    builder = ArquivoCNAB240Builder(FileTemplate240.FileItau)
+    fill_required(builder.header)
+
+    broken = new_batch()
+    broken.add(new_record(0))
+    broken.content[0].content['seu_numero']['val'] = None
+    with pytest.raises(CNABInvalidValueError):
+        builder.add(broken)
+
+    for batch in new_file(batches=2, payments=3).content:
+        builder.add(batch)
+    output = io.BytesIO()
+    builder.finalize(output)
+
+    assert output.getvalue() == new_file(batches=2, payments=3).make().encode('latin-1')
@@ -0,0 +1,114 @@
+import gc
+import pickle
+
+import pytest
+
+import brbankingcnab
+from brbankingcnab import CNABInvalidValueError, set_cache_limit
+from conftest import new_file, new_record
+
+
+@pytest.fixture(autouse=True)
+def no_cache_limit():
+    yield
+    set_cache_limit(None)
+
+
+def numbered_record(number):
+    record = new_record(number)
+    record.content['codigo_lote']['val'] = 1
+    record.content['numero_registro']['val'] = 1
+    return record
+
+
+def test_field_edit_invalidates_line():
+    record = numbered_record(1)
+    first = record.make()
+    assert record.content.baked is not None
+
+    record.content['valor_pagamento']['val'] = 999
+    assert record.content.baked is None
+    assert record.make() != first
+
+    expected = numbered_record(1)
+    expected.content['valor_pagamento']['val'] = 999
+    assert record.make() == expected.make()
+
+
+def test_edit_in_file_matches_fresh_make(cnab_file):
+    cnab_file.make()
+    cnab_file.content[1].content[2].content['seu_numero']['val'] = 'OUTRO'
+    expected = new_file()
+    expected.content[1].content[2].content['seu_numero']['val'] = 'OUTRO'
+    assert cnab_file.make() == expected.make()
+
+
+@pytest.mark.parametrize('mutate', [
+    lambda field: field.pop('val'),
+    lambda field: field.__delitem__('val'),
+    lambda field: field.clear(),
+    lambda field: field.update(val=None),
+])
+def test_other_field_mutators_invalidate(mutate):
+    record = numbered_record(1)
+    record.make()
+    mutate(record.content['seu_numero'])
+    assert record.content.baked is None
+
+
+def test_line_mutators_invalidate():
+    record = numbered_record(1)
+    record.make()
+    record.content.setdefault('extra', {'val': 'X', 'index': 240, 'size': 1, 'type': 'alfa'})
+    assert record.content.baked is None
+
+    record.make(strict=False)
+    record.content.pop('extra')
+    assert record.content.baked is None
+
+
+def test_strict_raises_on_cached_line_with_missing_values():
+    record = numbered_record(1)
+    record.content['seu_numero']['val'] = None
+    assert '?' in record.make(strict=False)
+    assert record.content.baked_missing
+
+    with pytest.raises(CNABInvalidValueError):
+        record.make(strict=True)
+
+
+def test_discarded_record_is_freed_without_gc():
+    gc.disable()
+    try:
+        record = numbered_record(1)
+        record.make()
+        ref = record.content.ref
+        del record
+        assert ref() is None
+    finally:
+        gc.enable()
+
+
+def test_cache_limit_bounds_cached_lines():
+    set_cache_limit(10)
+    cnab_file = new_file()
+    expected = cnab_file.make()
+    assert len(brbankingcnab._line_cache) == 10
+    assert sum(record.content.baked is not None for batch in cnab_file.content for record in batch.content) <= 10
+    assert cnab_file.make() == expected
+
+
+def test_lines_cached_before_limit_are_tracked_again():
+    record = numbered_record(1)
+    expected = record.make()
+    set_cache_limit(5)
+    assert not brbankingcnab._line_cache
+    assert record.make() == expected
+    assert id(record.content) in brbankingcnab._line_cache
+
+
+def test_pickled_line_keeps_field_tracking():
+    record = pickle.loads(pickle.dumps(numbered_record(1)))
+    record.make()
+    record.content['valor_pagamento']['val'] = 999
+    assert record.content.baked is None
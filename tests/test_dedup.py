@@ -0,0 +1,114 @@
+import multiprocessing
+
+import pytest
+
+from brbankingcnab import CNABError, parse_cnab_string
+from brbankingcnab.cnab240 import FileTemplate240
+from brbankingcnab.dedup import DuplicatePaymentDetector, CNABDuplicatePaymentError
+from conftest import new_file, new_batch, new_record
+
+
+@pytest.fixture
+def index_path(tmp_path):
+    return str(tmp_path / 'pagamentos.sqlite')
+
+
+def test_finds_duplicates_after_reopen(index_path, cnab_file):
+    with DuplicatePaymentDetector(index_path) as detector:
+        assert detector.find_duplicates(cnab_file) == []
+        detector.register(cnab_file)
+
+    with DuplicatePaymentDetector(index_path) as detector:
+        assert len(detector.find_duplicates(cnab_file)) == 10
+        assert len(detector.find_duplicates(cnab_file.content[0])) == 5
+        assert detector.find_duplicates(new_file(first=50000)) == []
+
+
+def test_parsed_file_matches_built_file(index_path, cnab_file):
+    with DuplicatePaymentDetector(index_path) as detector:
+        detector.register(cnab_file)
+        parsed = parse_cnab_string(cnab_file.make(), 240, FileTemplate240.FileItau)
+        assert len(detector.find_duplicates(parsed)) == 10
+
+
+def test_finds_duplicates_registered_by_other_instance(index_path, cnab_file):
+    first = DuplicatePaymentDetector(index_path)
+    second = DuplicatePaymentDetector(index_path)
+    try:
+        assert first.find_duplicates(cnab_file) == []
+        second.register(cnab_file)
+        assert len(first.find_duplicates(cnab_file)) == 10
+        with pytest.raises(CNABDuplicatePaymentError):
+            first.validate(cnab_file)
+    finally:
+        first.close()
+        second.close()
+
+
+def test_register_fails_on_conflict(index_path, cnab_file):
+    with DuplicatePaymentDetector(index_path) as detector:
+        detector.register(cnab_file)
+        overlapping = new_file(batches=1, payments=3, first=50000)
+        overlapping.content[0].add(new_record(0))
+
+        with pytest.raises(CNABDuplicatePaymentError) as error:
+            detector.register(overlapping)
+        assert len(error.value.records) == 1
+        # Nada do bloco conflitante é gravado.
+        assert detector.count == 10
+
+        detector.register(overlapping, check=False)
+        assert detector.count == 13
+
+
+def test_repeated_payment_in_same_batch(index_path):
+    batch = new_batch()
+    batch.add(new_record(7))
+    batch.add(new_record(7))
+    with DuplicatePaymentDetector(index_path) as detector:
+        assert len(detector.find_duplicates(batch)) == 1
+
+
+def test_bloom_filter_grows_past_capacity(index_path):
+    with DuplicatePaymentDetector(index_path, capacity=4) as detector:
+        size = detector.bloom.size
+        cnab_file = new_file(batches=2, payments=5)
+        detector.register(cnab_file)
+        assert detector.capacity >= detector.count == 10
+        assert detector.bloom.size > size
+        assert len(detector.find_duplicates(cnab_file)) == 10
+
+
+def test_close_is_idempotent(index_path):
+    detector = DuplicatePaymentDetector(index_path)
+    detector.close()
+    detector.close()
+
+
+def test_rejects_different_fields(index_path):
+    DuplicatePaymentDetector(index_path).close()
+    with pytest.raises(CNABError):
+        DuplicatePaymentDetector(index_path, fields=('conta',))
+
+
+def open_index(path, barrier, errors):
+    barrier.wait()
+    try:
+        DuplicatePaymentDetector(path).close()
+    except Exception as e:
+        errors.put(repr(e))
+
+
+def test_processes_open_new_index_together(tmp_path):
+    context = multiprocessing.get_context()
+    errors = context.Queue()
+    for round_number in range(20):
+        path = str(tmp_path / f'novo{round_number}.sqlite')
+        barrier = context.Barrier(4)
+        processes = [context.Process(target=open_index, args=(path, barrier, errors)) for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        assert [process.exitcode for process in processes] == [0] * 4
+    assert errors.empty()
@@ -0,0 +1,82 @@
+import multiprocessing
+import pickle
+
+import pytest
+
+from brbankingcnab import CNABInvalidValueError, bake_cnab_string, bake_values, compile_layout, line_payload
+from brbankingcnab.cnab240 import CNAB240_LINE_SIZE
+
+
+@pytest.mark.parametrize('workers', [1, 2, 3, 7])
+def test_make_parallel_matches_make(cnab_file, workers):
+    assert bytes(cnab_file.make_parallel(workers=workers)) == cnab_file.make().encode('latin-1')
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_make_parallel_to_file(cnab_file, tmp_path, workers):
+    path = str(tmp_path / 'remessa.rem')
+    assert cnab_file.make_parallel(workers=workers, path=path) == path
+    with open(path, 'rb') as file:
+        data = file.read()
+    assert data == cnab_file.make().encode('latin-1')
+    assert len(data) % CNAB240_LINE_SIZE == 0
+
+
+def test_make_parallel_with_spawn(cnab_file):
+    context = multiprocessing.get_context('spawn')
+    assert bytes(cnab_file.make_parallel(workers=2, mp_context=context)) == cnab_file.make().encode('latin-1')
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_make_parallel_raises_worker_errors(cnab_file, workers):
+    cnab_file.content[-1].content[-1].content['inscricao_numero']['val'] = None
+    with pytest.raises(CNABInvalidValueError):
+        cnab_file.make_parallel(workers=workers)
+    assert len(cnab_file.make_parallel(workers=workers, strict=False)) == len(cnab_file.make(strict=False))
+
+
+def test_line_payload_is_compact(cnab_file):
+    blocks = cnab_file.list_line_blocks()
+    payloads = [line_payload(block) for block in blocks]
+    assert all(isinstance(payload, tuple) for payload in payloads)
+    assert len(pickle.dumps(payloads)) * 3 < len(pickle.dumps(blocks))
+
+    for block, (template_path, values) in zip(blocks, payloads):
+        assert bake_values(values, compile_layout(template_path)) == bake_cnab_string(block)
+
+
+def test_line_payload_of_cached_and_edited_lines(cnab_file):
+    cnab_file.make()
+    record = cnab_file.content[0].content[0].content
+    assert line_payload(record) == record.baked
+
+    record['valor_pagamento']['val'] = 5
+    assert line_payload(record)[0] == record.template_path
+
+    # Linha que não segue mais o layout do template é gerada no processo atual.
+    record['seu_numero']['size'] = 10
+    assert record.template_path is None
+    assert line_payload(record) == bake_cnab_string(record)
+
+
+@pytest.mark.parametrize('method', ['spawn', 'forkserver'])
+def test_make_parallel_without_fork_ships_payloads(cnab_file, method):
+    if method not in multiprocessing.get_all_start_methods():
+        pytest.skip(f'{method} indisponível')
+    context = multiprocessing.get_context(method)
+
+    # Mistura linhas em cache, linhas editadas e uma linha fora do layout do template.
+    cnab_file.make()
+    cnab_file.content[0].content[2].content['seu_numero']['val'] = 'OUTRO'
+    cnab_file.content[1].content[0].content['seu_numero']['descr'] = 'Editado'
+    expected = cnab_file.make().encode('latin-1')
+    # Editada e restaurada: perde o cache, mas o resultado é o mesmo.
+    field = cnab_file.content[1].content[2].content['valor_pagamento']
+    original = field['val']
+    field['val'] = 1
+    field['val'] = original
+    assert bytes(cnab_file.make_parallel(workers=2, mp_context=context)) == expected
+
+    cnab_file.content[-1].content[-1].content['inscricao_numero']['val'] = None
+    with pytest.raises(CNABInvalidValueError):
+        cnab_file.make_parallel(workers=2, mp_context=context)
@@ -0,0 +1,185 @@
+import http.client
+import json
+import operator
+import os
+import threading
+
+import pytest
+
+from brbankingcnab.server import UNKNOWN_ROUTE, CNABRequestHandler, CNABServer
+from conftest import new_file
+
+
+def start_server():
+    server = CNABServer(('127.0.0.1', 0), workers=1, quiet=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def stop_server(server):
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(scope='module')
+def server():
+    server = start_server()
+    yield server
+    stop_server(server)
+
+
+def connect(server):
+    return http.client.HTTPConnection(*server.server_address, timeout=30)
+
+
+def post(connection, path, body, headers=None):
+    connection.request('POST', path, body=body, headers=headers or {})
+    response = connection.getresponse()
+    return response, response.read()
+
+
+def spec(records=2, **overrides):
+    spec = {
+        'header': {'nome_empresa': 'EMPRESA'},
+        'batches': [{
+            'template': 'Itau_Cheq_OP_DOC_TED_PIX_CredCC',
+            'records': [{'template': 'Itau_SegA_Cheq_OP_DOC_TED_PIX_CredCC_misc',
+                         'fields': {'valor_pagamento': 100 + index}} for index in range(records)],
+        }],
+        'strict': False,
+    }
+    spec.update(overrides)
+    return json.dumps(spec)
+
+
+def test_generate(server):
+    response, body = post(connect(server), '/generate', spec())
+    assert response.status == 200
+    assert int(response.getheader('Content-Length')) == len(body) == 242 * 6
+    assert body.decode('latin-1').split('\r\n')[2][119:134] == '000000000000100'
+
+
+def test_summary(server):
+    data = new_file(batches=2, payments=3).make().encode('latin-1')
+    response, result = post(connect(server), '/summary', data)
+    assert response.status == 200
+    assert json.loads(result)['count'] == 6
+
+
+def test_parse_roundtrip(server):
+    data = new_file(batches=1, payments=2).make().encode('latin-1')
+    response, body = post(connect(server), '/parse?file_template=FileItau', data)
+    assert response.status == 200
+    assert [record['valor_pagamento'] for record in json.loads(body)['batches'][0]['records'][::2]] == [100, 101]
+
+
+def test_chunked_request(server):
+    connection = connect(server)
+    connection.request('POST', '/generate', body=iter([spec().encode()[:10], spec().encode()[10:]]),
+                       encode_chunked=True)
+    response = connection.getresponse()
+    assert response.status == 200
+    assert len(response.read()) == 242 * 6
+
+
+def test_unknown_route_closes_connection(server):
+    connection = connect(server)
+    response, body = post(connection, '/nope', b'GET /health HTTP/1.1\r\n\r\n')
+    assert response.status == 404
+    assert response.getheader('Connection') == 'close'
+
+    # A conexão é reaberta, e o corpo não lido não é interpretado como outra requisição.
+    response, _ = post(connection, '/generate', spec())
+    assert response.status == 200
+
+
+def test_unknown_routes_share_one_metrics_key(server):
+    connection = connect(server)
+    for index in range(3):
+        post(connection, f'/nope{index}', b'')
+    connection.request('GET', '/metrics')
+    routes = json.loads(connection.getresponse().read())['routes']
+    assert routes[UNKNOWN_ROUTE]['count'] >= 3
+    assert not any(route.startswith('/nope') for route in routes)
+
+
+@pytest.mark.parametrize('body', [
+    '[]',
+    '{"batches": {}}',
+    '{"batches": [[]]}',
+    '{"batches": [{"records": []}]}',
+    '{"header": {"nao_existe": 1}}',
+    '{"file_template": "Nenhum"}',
+    'não é JSON',
+    '{"batches": [{"template": "Itau_Blt_Cod_Bar_PIXqr_tit_trib_conces_FGTS"}]}',
+    '{"header": {"nome_empresa": 1}}',
+    '{"header": {"nome_empresa": "\\u20ac"}}',
+])
+def test_invalid_spec_is_bad_request(server, body):
+    connection = connect(server)
+    response, result = post(connection, '/generate', body.encode('utf-8'))
+    assert response.status == 400
+    assert json.loads(result)['error']
+
+    # Corpo foi lido: a conexão continua utilizável.
+    response, _ = post(connection, '/generate', spec())
+    assert response.status == 200
+
+
+def test_bad_chunk_size_is_bad_request(server):
+    connection = connect(server)
+    connection.putrequest('POST', '/generate')
+    connection.putheader('Transfer-Encoding', 'chunked')
+    connection.endheaders(b'zz\r\n')
+    response = connection.getresponse()
+    assert response.status == 400
+    assert response.getheader('Connection') == 'close'
+
+
+def test_invalid_cnab_is_unprocessable(server):
+    response, result = post(connect(server), '/parse', b'X' * 240)
+    assert response.status == 422
+    assert json.loads(result)['error']
+
+
+def test_strict_missing_fields_is_unprocessable(server):
+    response, _ = post(connect(server), '/generate', spec(strict=True))
+    assert response.status == 422
+
+
+def test_unexpected_error_is_internal_error(server, monkeypatch):
+    # operator.concat lança TypeError com os dois arquivos abertos pelo processo do pool.
+    monkeypatch.setitem(CNABRequestHandler.routes, '/broken', (operator.concat, 'application/json', ()))
+    connection = connect(server)
+    response, result = post(connection, '/broken', b'{}')
+    assert response.status == 500
+    assert 'TypeError' in json.loads(result)['error']
+
+    connection.request('GET', '/metrics')
+    assert json.loads(connection.getresponse().read())['routes']['/broken']['errors'] == 1
+
+
+def test_broken_pool_is_recreated():
+    server = start_server()
+    try:
+        broken = server.pool
+        broken.submit(os._exit, 1)
+
+        connection = connect(server)
+        response, _ = post(connection, '/generate', spec())
+        assert response.status == 500
+        assert server.pool is not broken
+
+        response, _ = post(connection, '/generate', spec())
+        assert response.status == 200
+    finally:
+        stop_server(server)
+
+
+@pytest.mark.parametrize('value', ['abc', None, 10.5, True, -1, 10 ** 15])
+def test_invalid_field_value_is_bad_request(server, value):
+    body = json.loads(spec())
+    body['batches'][0]['records'][0]['fields']['valor_pagamento'] = value
+    response, result = post(connect(server), '/generate', json.dumps(body))
+    assert response.status == 400
+    assert 'valor_pagamento' in json.loads(result)['error']
@@ -0,0 +1,104 @@
+import datetime
+
+import pytest
+
+from brbankingcnab import CNABError, parse_cnab_string
+from brbankingcnab.cnab240 import SEGMENTO_A, FileTemplate240
+from brbankingcnab.summary import summarize_cnab240
+from conftest import new_file
+
+
+def parsed_totals(text):
+    """Totais por lote e por banco calculados a partir da árvore de blocos de parse_cnab_string()."""
+    batches, banks = {}, {}
+    for batch in parse_cnab_string(text, 240, FileTemplate240.FileItau).content:
+        for record in batch.content:
+            if record.content['segmento']['val'] != SEGMENTO_A:
+                continue
+            value = record.content['valor_pagamento']['val']
+            for groups, key in ((batches, batch.header['codigo_lote']['val']),
+                                (banks, record.content['banco_favor_codigo']['val'])):
+                group = groups.setdefault(key, {'count': 0, 'valor_pagamento': 0})
+                group['count'] += 1
+                group['valor_pagamento'] += value
+    return batches, banks
+
+
+@pytest.fixture
+def text():
+    cnab_file = new_file(batches=3, payments=7)
+    records = [record.content for batch in cnab_file.content for record in batch.content
+               if record.content['segmento']['val'] == SEGMENTO_A]
+    records[0]['ocorrencias']['val'] = '00'
+    records[1]['ocorrencias']['val'] = 'BDAE'
+    records[2]['ocorrencias']['val'] = 'AE00BD'
+    records[3]['data_efetiva']['val'] = 15032026
+    records[4]['data_efetiva']['val'] = 2022026
+    return cnab_file.make()
+
+
+def test_totals_match_parsed_file(text):
+    summary = summarize_cnab240(text)
+    batches, banks = parsed_totals(text)
+
+    assert summary['batches'] == batches
+    assert summary['banks'] == banks
+    assert summary['count'] == sum(group['count'] for group in batches.values()) == 21
+    assert summary['valor_pagamento'] == sum(group['valor_pagamento'] for group in batches.values())
+
+
+def test_occurrences_with_several_codes(text):
+    # Registros 0, 1 e 2 têm valor_pagamento 100, 101 e 102.
+    assert summarize_cnab240(text)['occurrences'] == {
+        '00': {'count': 2, 'valor_pagamento': 100 + 102},
+        'BD': {'count': 2, 'valor_pagamento': 101 + 102},
+        'AE': {'count': 2, 'valor_pagamento': 101 + 102},
+    }
+
+
+def test_string_and_file_input(text, tmp_path):
+    path = tmp_path / 'retorno.ret'
+    path.write_bytes(text.encode('latin-1'))
+
+    expected = summarize_cnab240(text)
+    with open(path, 'r', encoding='latin-1') as file:
+        assert summarize_cnab240(file) == expected
+    with open(path, 'r', encoding='latin-1', newline='') as file:
+        assert summarize_cnab240(file) == expected
+
+
+def test_line_endings(text):
+    assert '\r\n' in text
+    assert summarize_cnab240(text.replace('\r\n', '\n')) == summarize_cnab240(text)
+
+
+def test_date_ranges(text):
+    summary = summarize_cnab240(text)
+    # Os lotes pagam nos dias 1 a 7, 21 a 27 e 13 a 19 de janeiro. data_efetiva é zerada nos demais registros.
+    assert summary['data_pagamento'] == (datetime.date(2026, 1, 1), datetime.date(2026, 1, 27))
+    assert summary['data_efetiva'] == (datetime.date(2026, 2, 2), datetime.date(2026, 3, 15))
+
+
+def test_invalid_dates_are_ignored():
+    cnab_file = new_file(batches=1, payments=3)
+    records = cnab_file.content[0].content  # Segmento A nas posições 0, 2 e 4.
+    records[0].content['data_pagamento']['val'] = '00000000'
+    records[2].content['data_pagamento']['val'] = '31022026'
+    records[4].content['data_pagamento']['val'] = '01132026'
+
+    summary = summarize_cnab240(cnab_file.make())
+    assert summary['count'] == 3
+    assert summary['data_pagamento'] == (None, None)
+    assert summary['data_efetiva'] == (None, None)
+
+    # Uma data inválida fora do intervalo das válidas não o substitui.
+    records[0].content['data_pagamento']['val'] = '03012026'
+    assert summarize_cnab240(cnab_file.make())['data_pagamento'] == (datetime.date(2026, 1, 3),
+                                                                      datetime.date(2026, 1, 3))
+
+
+def test_record_outside_batch():
+    lines = new_file(batches=1, payments=1).make().split('\r\n')
+    del lines[1]  # Header de lote.
+    with pytest.raises(CNABError):
+        summarize_cnab240('\r\n'.join(lines))